@@ -1,22 +1,166 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
 import subprocess
+import functools
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import getpass
 
+# Existence checks for config paths, filled lazily so each path is stat()ed once per run.
+_exists_cache = {}
+
+# Status messages, written to stdout in one go by flush_log() instead of a write per print().
+_log = []
+
+# Both stop before a CRLF's \r so rewritten lines keep their original line ending.
+_FONT_RE = re.compile(r'(?m)^[ \t]*font[ \t][^\r\n]*')
+_XRANDR_RE = re.compile(r'(?m)^[ \t]*exec xrandr --dpi[^\r\n]*(\r?\n|\Z)')
+
+# Full contents for GTK config files that don't exist yet. GTK 3 and 4 read settings.ini
+# as a key file and only look at the [Settings] group, so new files start with that header.
+_GTK3_TPL = '[Settings]\ngtk-font-name={font}\ngtk-dpi={dpi}\ngtk-xft-dpi={xft}\n'
+_GTK2_TPL = 'gtk-font-name = {font}\ngtk-xft-dpi = {xft}\n'
+_GTK4_TPL = '[Settings]\ngtk-font-name={font}\ngtk-xft-dpi={xft}\n'
+
+def log(msg):
+    """Queue a status message for the next flush_log()."""
+    _log.append(msg + '\n')
+
+def flush_log():
+    """Write all queued status messages with a single write."""
+    if _log:
+        sys.stdout.write(''.join(_log))
+        sys.stdout.flush()
+        _log.clear()
+
+@functools.lru_cache(maxsize=None)
 def get_user_home():
     """Get the home directory of the user running the script."""
-    user_home = str(Path.home())
-    print(f"Detected user home directory: {user_home}")
+    user_home = os.environ.get('HOME')
+    if not user_home:
+        import pwd
+        user_home = pwd.getpwuid(os.getuid()).pw_dir
+    log(f"Detected user home directory: {user_home}")
     return user_home
 
+def path_exists(file_path):
+    """Check whether a path exists, remembering the answer for later calls."""
+    if file_path not in _exists_cache:
+        _exists_cache[file_path] = os.path.exists(file_path)
+    return _exists_cache[file_path]
+
+def resolve_i3_config(user_home):
+    """Return the i3 config path in use, preferring ~/.config/i3 over the legacy ~/.i3."""
+    i3_config_path = os.path.join(user_home, ".config/i3/config")
+    legacy_i3_config_path = os.path.join(user_home, ".i3/config")
+
+    try:
+        os.stat(i3_config_path)
+    except OSError:  # Anything os.path.exists() would have reported as False
+        _exists_cache[i3_config_path] = False
+        return legacy_i3_config_path if path_exists(legacy_i3_config_path) else i3_config_path
+    _exists_cache[i3_config_path] = True
+    return i3_config_path
+
+def read_file(file_path, missing_ok=True):
+    """Read the whole file in one go, or return '' if it is missing and missing_ok is set."""
+    # Just try the read: a missing file costs one failed open instead of a stat plus an open.
+    try:
+        data = Path(file_path).read_bytes()
+    except FileNotFoundError:
+        _exists_cache[file_path] = False
+        if missing_ok:
+            return ''
+        raise
+    _exists_cache[file_path] = True
+    # surrogateescape round-trips any bytes that aren't valid UTF-8 unchanged.
+    return data.decode('utf-8', errors='surrogateescape')
+
+def ensure_parent_dir(file_path):
+    """Create the directory holding the file if it doesn't exist yet."""
+    parent = os.path.dirname(file_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+def write_file(file_path, text):
+    """Write the text in a single call through a temp file, then swap it into place.
+
+    Symlinks are followed so the real file is replaced, and an existing file keeps its
+    mode and, where permitted, its owner.
+    """
+    real_path = os.path.realpath(file_path)
+    directory, base = os.path.split(real_path)
+    try:
+        st = os.stat(real_path)
+    except FileNotFoundError:
+        st = None
+    # New files get the usual 0o666 less the umask; existing ones start from their own mode.
+    mode = st.st_mode & 0o7777 if st is not None else 0o666
+
+    # A random name opened with O_EXCL never clobbers an unrelated file.
+    while True:
+        tmp_path = os.path.join(directory, f".{base}.{os.urandom(4).hex()}.tmp")
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        try:
+            if st is not None:
+                os.fchmod(fd, mode)  # The umask may have masked bits at creation
+                try:
+                    os.fchown(fd, st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+            # Plain os.write() on a raw fd: these files are tiny, so skip the io buffering layers.
+            data = memoryview(text.encode('utf-8', errors='surrogateescape'))
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, real_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _exists_cache[file_path] = True
+
+def write_file_if_changed(file_path, original, text):
+    """Write the text unless the file already holds exactly that; return whether it was written."""
+    if text == original:
+        return False
+    write_file(file_path, text)
+    return True
+
+def patch_in_place(file_path, offset, old, new):
+    """Overwrite the bytes old at offset with new, padded with spaces, without rewriting the file.
+
+    Like write_file(), this goes through symlinks and leaves the file's mode and owner alone.
+    The padding stays in the file as trailing whitespace. Returns False if new is longer than
+    old or the file no longer holds old there.
+    """
+    if len(new) > len(old):
+        return False
+    with open(file_path, 'r+b') as file, mmap.mmap(file.fileno(), 0) as mapped:
+        end = offset + len(old)
+        if mapped[offset:end] != old:
+            return False
+        mapped[offset:end] = new.ljust(len(old), b' ')
+        mapped.flush()
+    return True
+
 def update_or_append_line(file_path, key, value, command=False):
     """Update a line in the file if the key exists, otherwise append it."""
-    lines = []
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+    original = read_file(file_path)
+    lines = original.splitlines(keepends=True)
 
     updated = False
     for i, line in enumerate(lines):
@@ -27,155 +171,241 @@ def update_or_append_line(file_path, key, value, command=False):
             lines[i] = f"{key}: {value}\n" if file_path.endswith('.Xresources') else f"{key}={value}\n"
             updated = True
 
+    text = ''.join(lines)
     if not updated:
         if command:
-            lines.append(f"{key} {value}\n")
+            text = append_lines(text, [f"{key} {value}\n"])
         else:
-            lines.append(f"{key}: {value}\n" if file_path.endswith('.Xresources') else f"{key}={value}\n")
+            text = append_lines(text, [f"{key}: {value}\n" if file_path.endswith('.Xresources')
+                                       else f"{key}={value}\n"])
 
-    with open(file_path, 'w') as file:
-        file.writelines(lines)
+    return write_file_if_changed(file_path, original, text)
+
+def append_lines(text, lines):
+    """Append lines to the text, making sure they start on a fresh line."""
+    if not lines:
+        return text
+    if text and not text.endswith("\n"):
+        text += "\n"
+    return text + ''.join(lines)
+
+@functools.lru_cache(maxsize=None)
+def settings_pattern(keys):
+    """Compile the pattern matching any of the given setting keys, once per key set."""
+    return re.compile(r'(?m)^[ \t]*(' + '|'.join(map(re.escape, keys)) + r')[ \t]*[:=].*$')
+
+@functools.lru_cache(maxsize=None)
+def export_pattern(keys):
+    """Compile the pattern matching an export of any of the given variables, once per key set."""
+    return re.compile(r'(?m)^[ \t]*export[ \t]+(' + '|'.join(map(re.escape, keys)) + r')=.*$')
+
+def format_setting(config_path, key, value):
+    """Format a single setting line in the style used by the given config file."""
+    return f"{key}={value}" if config_path.endswith(".ini") else f"{key} = {value}"
 
 def update_config_file(config_path, settings_dict):
     """Update the configuration file with the provided settings."""
-    if not os.path.exists(config_path):
-        os.makedirs(os.path.dirname(config_path), exist_ok=True)
-        open(config_path, 'w').close()
-
-    with open(config_path, 'r') as file:
-        lines = file.readlines()
-
-    updated_lines = []
-    for line in lines:
-        updated = False
-        for key, value in settings_dict.items():
-            if line.strip().startswith(key):
-                updated_lines.append(f"{key}={value}\n" if config_path.endswith(".ini") else f"{key} = {value}\n")
-                updated = True
-                break
-        if not updated:
-            updated_lines.append(line)
-
-    for key, value in settings_dict.items():
-        if not any(line.strip().startswith(key) for line in updated_lines):
-            updated_lines.append(f"{key}={value}\n" if config_path.endswith(".ini") else f"{key} = {value}\n")
-
-    with open(config_path, 'w') as file:
-        file.writelines(updated_lines)
+    ensure_parent_dir(config_path)
+
+    original = text = read_file(config_path)
+
+    # Rewrite every line setting one of the keys in a single regex pass.
+    seen = set()
+
+    def replace_setting(match):
+        key = match.group(1)
+        seen.add(key)
+        return format_setting(config_path, key, settings_dict[key])
+
+    text = settings_pattern(tuple(settings_dict)).sub(replace_setting, text)
+
+    # Only keys the substitution never saw need appending, an O(K) set lookup.
+    text = append_lines(text, [format_setting(config_path, key, value) + "\n"
+                               for key, value in settings_dict.items() if key not in seen])
+
+    return write_file_if_changed(config_path, original, text)
 
 def set_xresources_dpi(dpi, user_home):
     xresources_path = os.path.join(user_home, ".Xresources")
-    update_or_append_line(xresources_path, "Xft.dpi", dpi)
-    subprocess.run(["xrdb", "-merge", xresources_path])
-    print(f"Set Xft DPI to {dpi} in {xresources_path}.")
+    if not update_or_append_line(xresources_path, "Xft.dpi", dpi):
+        return None, f"Xft DPI is already {dpi} in {xresources_path}."
+    # Let xrdb run in the background; the caller waits on it before restarting i3.
+    return (subprocess.Popen(["xrdb", "-merge", xresources_path]),
+            f"Set Xft DPI to {dpi} in {xresources_path}.")
 
 def set_i3_font_size(font_size, dpi, user_home):
-    i3_config_path = os.path.join(user_home, ".config/i3/config")
-    legacy_i3_config_path = os.path.join(user_home, ".i3/config")
-    
-    if not os.path.exists(i3_config_path) and os.path.exists(legacy_i3_config_path):
-        i3_config_path = legacy_i3_config_path
-
-    with open(i3_config_path, 'r') as file:
-        config_lines = file.readlines()
-
-    with open(i3_config_path, 'w') as file:
-        xrandr_command = f"exec xrandr --dpi {dpi}"
-        xrandr_found = False
-
-        for line in config_lines:
-            if line.strip().startswith("font"):
-                line = f"font pango:monospace {font_size}\n"
-            elif line.strip().startswith("exec xrandr --dpi"):
-                if not xrandr_found:
-                    line = f"{xrandr_command}\n"
-                    xrandr_found = True
-                else:
-                    continue  # Skip any duplicate lines
-            file.write(line)
-
-        # If the xrandr command was not found, append it
-        if not xrandr_found:
-            file.write(f"{xrandr_command}\n")
-            print(f"Added '{xrandr_command}' to {i3_config_path}.")
-        else:
-            print(f"'{xrandr_command}' was already present and updated if needed in {i3_config_path}.")
-
-def set_gtk_scaling(dpi, font_size, user_home):
+    i3_config_path = resolve_i3_config(user_home)
+    original = text = read_file(i3_config_path, missing_ok=False)
+
+    xrandr_command = f"exec xrandr --dpi {dpi}"
+    font_line = f"font pango:monospace {font_size}"
+    font_matches = []
+
+    def replace_font(match):
+        if match.group(0).rstrip() == font_line:
+            return match.group(0)  # Already set, possibly padded by an earlier in-place edit
+        font_matches.append(match)
+        return font_line
+
+    after_font = text = _FONT_RE.sub(replace_font, text)
+
+    xrandr_found = False
+
+    def replace_xrandr(match):
+        nonlocal xrandr_found
+        if xrandr_found:
+            return ""  # Drop any duplicate lines
+        xrandr_found = True
+        return xrandr_command + (match.group(1) or "\n")
+
+    text = _XRANDR_RE.sub(replace_xrandr, text)
+
+    # If the xrandr command was not found, append it
+    if not xrandr_found:
+        text = append_lines(text, [f"{xrandr_command}\n"])
+
+    # When only a single font line changed, overwrite just that line instead of the whole file.
+    # This path is deliberately not atomic and pads with spaces that stay as trailing whitespace,
+    # which is why replace_font() compares with rstrip(): without it re-runs would never be no-ops.
+    if text == after_font and len(font_matches) == 1:
+        match = font_matches[0]
+        offset = len(original[:match.start()].encode('utf-8', errors='surrogateescape'))
+        old = match.group(0).encode('utf-8', errors='surrogateescape')
+        changed = patch_in_place(i3_config_path, offset, old, font_line.encode('utf-8'))
+    else:
+        changed = False
+    if not changed:
+        changed = write_file_if_changed(i3_config_path, original, text)
+
+    if not xrandr_found:
+        return changed, f"Added '{xrandr_command}' to {i3_config_path}."
+    return changed, f"'{xrandr_command}' was already present and updated if needed in {i3_config_path}."
+
+def write_full_config(config_path, content):
+    """Write a config file whose full content is known, without reading it first."""
+    ensure_parent_dir(config_path)
+    write_file(config_path, content)
+    return True
+
+def set_gtk_scaling(dpi, xft_dpi, gtk_font, user_home):
     gtk3_config_path = os.path.join(user_home, ".config/gtk-3.0/settings.ini")
     gtk2_config_path = os.path.join(user_home, ".gtkrc-2.0")
     gtk4_config_path = os.path.join(user_home, ".config/gtk-4.0/settings.ini")
 
-    gtk3_settings = {
-        "gtk-font-name": f"Sans {font_size}",
-        "gtk-dpi": dpi,
-        "gtk-xft-dpi": dpi * 1000
+    # GTK 2 and 4 take the same settings; GTK 3 also gets gtk-dpi.
+    gtk_settings = {
+        "gtk-font-name": gtk_font,
+        "gtk-xft-dpi": xft_dpi
     }
-    update_config_file(gtk3_config_path, gtk3_settings)
 
-    gtk2_settings = {
-        "gtk-font-name": f"Sans {font_size}",
-        "gtk-xft-dpi": dpi * 1000
-    }
-    update_config_file(gtk2_config_path, gtk2_settings)
+    # Files that don't exist yet have nothing to preserve, so write them in one go.
+    if path_exists(gtk3_config_path):
+        # Same keys plus gtk-dpi, kept between the font name and gtk-xft-dpi.
+        gtk_items = list(gtk_settings.items())
+        gtk3_settings = dict(gtk_items[:1] + [("gtk-dpi", dpi)] + gtk_items[1:])
+        changed = update_config_file(gtk3_config_path, gtk3_settings)
+    else:
+        changed = write_full_config(
+            gtk3_config_path, _GTK3_TPL.format(font=gtk_font, dpi=dpi, xft=xft_dpi))
 
-    gtk4_settings = {
-        "gtk-font-name": f"Sans {font_size}",
-        "gtk-xft-dpi": dpi * 1000
-    }
-    update_config_file(gtk4_config_path, gtk4_settings)
+    if path_exists(gtk2_config_path):
+        changed |= update_config_file(gtk2_config_path, gtk_settings)
+    else:
+        changed |= write_full_config(
+            gtk2_config_path, _GTK2_TPL.format(font=gtk_font, xft=xft_dpi))
 
-def update_or_append_env_var(file_path, key, value):
-    """Update or append environment variable in the file."""
-    lines = []
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
+    if path_exists(gtk4_config_path):
+        changed |= update_config_file(gtk4_config_path, gtk_settings)
+    else:
+        changed |= write_full_config(
+            gtk4_config_path, _GTK4_TPL.format(font=gtk_font, xft=xft_dpi))
 
-    updated = False
-    for i, line in enumerate(lines):
-        if line.strip().startswith(f"export {key}="):
-            if line.strip().split("=")[-1] != str(value):
-                lines[i] = f"export {key}={value}\n"
-            updated = True
+    return changed, None
 
-    if not updated:
-        lines.append(f"export {key}={value}\n")
+def update_env_vars(file_path, env_vars):
+    """Update or append environment variable exports in the file in one pass."""
+    original = text = read_file(file_path)
 
-    with open(file_path, 'w') as file:
-        file.writelines(lines)
+    seen = set()
+
+    def replace_export(match):
+        key = match.group(1)
+        seen.add(key)
+        return f"export {key}={env_vars[key]}"
+
+    text = export_pattern(tuple(env_vars)).sub(replace_export, text)
+
+    text = append_lines(text, [f"export {key}={value}\n"
+                               for key, value in env_vars.items() if key not in seen])
+
+    return write_file_if_changed(file_path, original, text)
 
 def set_qt_scaling(dpi, scale_factor, user_home):
     profile_path = os.path.join(user_home, ".profile")
-    update_or_append_env_var(profile_path, "QT_SCALE_FACTOR", scale_factor)
-    update_or_append_env_var(profile_path, "QT_FONT_DPI", dpi)
-    print(f"Set QT scaling in {profile_path}.")
+    changed = update_env_vars(profile_path, {"QT_SCALE_FACTOR": scale_factor, "QT_FONT_DPI": dpi})
+    return changed, (f"Set QT scaling in {profile_path}." if changed
+                     else f"QT scaling is already set in {profile_path}.")
 
 def restart_i3wm():
-    subprocess.run(["i3-msg", "restart"])
-    print("Restarted i3wm to apply changes.")
+    # Start i3-msg without blocking; the caller waits on it after flushing the log.
+    log("Requested an i3wm restart to apply changes.")
+    return subprocess.Popen(["i3-msg", "restart"])
 
 def main():
+    restart_process = None
     try:
         current_user = getpass.getuser()
-        print(f"Script is running as user: {current_user}")
+        log(f"Script is running as user: {current_user}")
 
         user_home = get_user_home()
+        flush_log()  # Show what was detected before prompting
 
         dpi = int(input("Enter desired DPI (e.g., 96, 120, 144): "))
         font_size = int(input("Enter desired font size for i3 and GTK apps (e.g., 12, 14): "))
         scale_factor = dpi / 96
 
-        set_xresources_dpi(dpi, user_home)
-        set_i3_font_size(font_size, dpi, user_home)
-        set_gtk_scaling(dpi, font_size, user_home)
-        set_qt_scaling(dpi, scale_factor, user_home)
-
-        print("Configuration changes applied successfully. Restarting i3wm...")
-        restart_i3wm()
+        # Format every derived value once; the setters only splice these strings in.
+        dpi_str = str(dpi)
+        xft_dpi = str(dpi * 1000)
+        font_size_str = str(font_size)
+        gtk_font = f"Sans {font_size}"
+        scale_factor_str = str(scale_factor)
+
+        # The setters touch disjoint files, so let their I/O and subprocesses overlap.
+        # Each returns its status message, logged in submission order so the output is stable.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(set_xresources_dpi, dpi_str, user_home),
+                executor.submit(set_i3_font_size, font_size_str, dpi_str, user_home),
+                executor.submit(set_gtk_scaling, dpi_str, xft_dpi, gtk_font, user_home),
+                executor.submit(set_qt_scaling, dpi_str, scale_factor_str, user_home),
+            ]
+            results = []
+            for future in futures:
+                result, message = future.result()
+                if message:
+                    log(message)
+                results.append(result)
+
+        xrdb_process, changed = results[0], results[1:]
+
+        if xrdb_process is None and not any(changed):
+            log("Configuration is already up to date. Not restarting i3wm.")
+            return
+
+        if xrdb_process is not None:
+            xrdb_process.wait()
+
+        log("Configuration changes applied successfully. Restarting i3wm...")
+        restart_process = restart_i3wm()
 
     except ValueError as e:
-        print(f"Invalid input: {e}")
+        log(f"Invalid input: {e}")
+    finally:
+        flush_log()
+        # Wait so i3-msg's own output lands before the shell prompt returns.
+        if restart_process is not None:
+            restart_process.wait()
 
 if __name__ == "__main__":
     main()